@@ -1,94 +1,282 @@
 import streamlit as st
-import requests
-import folium
-from streamlit_folium import folium_static
+import pydeck as pdk
 import google.generativeai as genai
-import json
-from typing import List, Dict, Any
-import asyncio
-import aiohttp
-from collections import Counter
+import hashlib
+import re
+import orjson
+from typing import List, Dict, Any, Iterator, Optional, Set, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
+import mmap
+import tempfile
+import httpx
+import diskcache
+import pandas as pd
 import geopandas as gpd
-from shapely.geometry import shape
+import shapely
 
 # Configure Gemini API using Streamlit secrets
 if 'GOOGLE_API_KEY' not in st.secrets:
   st.error("GOOGLE_API_KEY not found in Streamlit secrets. Please add it to your secrets.toml file.")
   st.stop()
 
-genai.configure(api_key=st.secrets["GOOGLE_API_KEY"])
-model = genai.GenerativeModel('gemini-pro')
+MODEL_NAME = 'gemini-pro'
 
-async def fetch_geojson_data(session: aiohttp.ClientSession, api_url: str) -> Dict[str, Any]:
-  """Fetch GeoJSON data from a given URL asynchronously."""
-  async with session.get(api_url) as response:
+@st.cache_resource
+def get_model() -> genai.GenerativeModel:
+  """Configure the Gemini client and create the model once per process."""
+  genai.configure(api_key=st.secrets["GOOGLE_API_KEY"])
+  return genai.GenerativeModel(MODEL_NAME)
+
+@st.cache_resource(show_spinner=False)
+def get_http_client() -> httpx.Client:
+  """Create the HTTP/2 client shared by every load, so connections and TLS sessions are reused."""
+  return httpx.Client(
+      http2=True,
+      limits=httpx.Limits(max_connections=16),
+      timeout=httpx.Timeout(30, connect=3),
+      follow_redirects=True
+  )
+
+def fetch_geojson_data(client: httpx.Client, api_url: str) -> Dict[str, Any]:
+  """Fetch GeoJSON data from a given URL, spooling large bodies to disk."""
+  with client.stream('GET', api_url) as response:
       response.raise_for_status()
-      return await response.json()
-
-def create_map(gdf: gpd.GeoDataFrame, center: List[float], zoom: int = 10) -> folium.Map:
-  """Create a folium map with the provided GeoDataFrame."""
-  m = folium.Map(location=center, zoom_start=zoom)
-  folium.GeoJson(
-      gdf.to_json(),
-      name="GeoJSON Layer",
-      style_function=lambda feature: {
-          'fillColor': 'green',
-          'color': 'black',
-          'weight': 2,
-          'fillOpacity': 0.7,
-      }
-  ).add_to(m)
-  folium.LayerControl().add_to(m)
-  return m
+      with tempfile.SpooledTemporaryFile(max_size=16 << 20) as buffer:
+          for chunk in response.iter_bytes(1 << 16):
+              buffer.write(chunk)
+          buffer.seek(0)
+          if not buffer._rolled:
+              return orjson.loads(buffer.read())
+          with mmap.mmap(buffer.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+              return orjson.loads(view)
+
+def features_to_gdf(features: List[Dict[str, Any]]) -> gpd.GeoDataFrame:
+  """Build a GeoDataFrame column-wise: GEOS parses all geometries in one vectorized call."""
+  geometries = shapely.from_geojson([
+      orjson.dumps(feature['geometry']) if feature.get('geometry') else None
+      for feature in features
+  ])
+  props_df = pd.DataFrame([feature.get('properties') or {} for feature in features])
+  return gpd.GeoDataFrame(props_df, geometry=geometries)
+
+@st.cache_resource(ttl=24 * 60 * 60, max_entries=32, show_spinner=False)
+def load_geojson(url: str) -> gpd.GeoDataFrame:
+  """Fetch a GeoJSON URL as a GeoDataFrame, shared across reruns and sessions. Failures raise, so they are never cached.
+
+  Only the columnar frame is kept; the parsed feature dicts are dropped once it is built.
+  The returned frame is a shared cache entry and must not be mutated.
+  """
+  return features_to_gdf(fetch_geojson_data(get_http_client(), url)['features'])
+
+MAP_STYLE = {
+    'get_fill_color': [0, 128, 0, 178],
+    'get_line_color': [0, 0, 0],
+    'line_width_min_pixels': 2,
+}
+
+def simplify_for_render(gdf: gpd.GeoDataFrame, tolerance: Optional[float] = None, grid_size: float = 1e-5) -> gpd.GeoDataFrame:
+  """Simplify geometries and snap coordinates to a grid to shrink the map payload.
+
+  By default the tolerance scales with the data's extent (1/4000 of its larger side).
+  """
+  if tolerance is None:
+      minx, miny, maxx, maxy = gdf.total_bounds
+      span = max(maxx - minx, maxy - miny)
+      tolerance = span / 4000 if span > 0 else 0.0
+  simplified = gdf.geometry.simplify(tolerance, preserve_topology=True)
+  snapped = shapely.set_precision(simplified.to_numpy(), grid_size)
+  return gdf.set_geometry(gpd.GeoSeries(snapped, index=gdf.index, crs=gdf.crs))
+
+@st.cache_resource(ttl=24 * 60 * 60, max_entries=32, show_spinner=False)
+def prepare_map_data(_gdf: gpd.GeoDataFrame, urls: Tuple[str, ...]) -> Dict[str, Any]:
+  """Deduplicate and simplify the geometries once per loaded URL set (the GeoDataFrame is not hashed).
+
+  The returned GeoJSON dict is a shared cache entry and must not be mutated.
+  """
+  geometries = _gdf[['geometry']]
+  geometries = geometries[~geometries.geometry.to_wkb().duplicated()]
+  return simplify_for_render(geometries).__geo_interface__
+
+def create_map(geojson: Dict[str, Any], center: List[float], zoom: int = 10) -> pdk.Deck:
+  """Create a WebGL (deck.gl) map of the prepared GeoJSON."""
+  layer = pdk.Layer(
+      'GeoJsonLayer',
+      data=geojson,
+      stroked=True,
+      filled=True,
+      **MAP_STYLE
+  )
+  return pdk.Deck(
+      layers=[layer],
+      initial_view_state=pdk.ViewState(latitude=center[0], longitude=center[1], zoom=zoom),
+      map_provider='carto',
+      map_style=pdk.map_styles.CARTO_LIGHT
+  )
+
+def count_values(column: pd.Series) -> Dict[Any, int]:
+  """Count a column's values, most frequent first, counting unhashable ones (JSON arrays or objects) by their string form."""
+  try:
+      return column.value_counts().to_dict()
+  except TypeError:
+      return column.dropna().astype(str).value_counts().to_dict()
+
+def top_k_with_other(counts: Dict[Any, int], k: int = 20) -> Dict[Any, int]:
+  """Keep the k most frequent values and fold the remaining counts into an "__other__" bucket."""
+  items = list(counts.items())
+  top = dict(items[:k])
+  if len(items) > k:
+      top["__other__"] = sum(count for _, count in items[k:])
+  return top
+
+def value_index_key(value: Any) -> str:
+  """Lower-cased string form of a value, writing integral floats as integers ('10', not '10.0')."""
+  if isinstance(value, float) and value.is_integer():
+      return str(int(value))
+  return str(value).lower()
+
+def build_value_index(value_counts: Dict[str, Dict[Any, int]]) -> Dict[str, Dict[str, int]]:
+  """Re-key each property's value counts by value_index_key for O(1) prompt lookups."""
+  index = {}
+  for prop, counts in value_counts.items():
+      series = pd.Series(counts, dtype='int64')
+      index[prop] = series.groupby(series.index.map(value_index_key)).sum().to_dict()
+  return index
 
 def analyze_geojson_structure(gdf: gpd.GeoDataFrame) -> Dict[str, Any]:
-  """Analyze the structure of the GeoDataFrame and return available properties."""
-  properties = gdf.columns.tolist()
-  properties.remove('geometry')
+  """Analyze the structure of the GeoDataFrame and return available properties.
+
+  Also precomputes, per property, a top-20 value-count digest for prompts and a
+  lower-cased value index for exact count lookups, plus numeric mean/median/sum,
+  so chat queries reuse them.
+  """
+  props_df = gdf.drop(columns='geometry')
+  value_counts = {prop: count_values(props_df[prop]) for prop in props_df.columns}
+  numeric_df = props_df.select_dtypes(include=['int64', 'float64'])
   
   return {
-      "properties": properties,
-      "property_types": {prop: str(gdf[prop].dtype) for prop in properties},
-      "sample_values": {prop: str(gdf[prop].iloc[0]) for prop in properties},
+      "properties": props_df.columns.tolist(),
+      "properties_by_name": {prop.lower(): prop for prop in props_df.columns},
+      "property_types": props_df.dtypes.astype(str).to_dict(),
+      "sample_values": props_df.iloc[0].astype(str).to_dict(),
       "feature_count": len(gdf),
-      "geometry_types": gdf.geometry.geom_type.value_counts().to_dict()
+      "geometry_types": gdf.geometry.geom_type.value_counts().to_dict(),
+      "value_index": build_value_index(value_counts),
+      "top_values": {prop: top_k_with_other(counts) for prop, counts in value_counts.items()},
+      "numeric_stats": numeric_df.agg(['mean', 'median', 'sum']).to_dict() if len(numeric_df.columns) else {}
   }
 
-def process_query(prompt: str, gdf: gpd.GeoDataFrame, geojson_structure: Dict[str, Any]) -> str:
-  """Process user query using Gemini API and geospatial data."""
+@st.cache_resource(ttl=24 * 60 * 60, max_entries=32, show_spinner=False)
+def build_dataset(urls: Tuple[str, ...]) -> Tuple[gpd.GeoDataFrame, Dict[str, Any]]:
+  """Merge the GeoDataFrames of the given URLs into one and analyze it, once per URL set.
+
+  The returned objects are shared cache entries and must not be mutated.
+  """
+  if not urls:
+      raise ValueError("no features were loaded")
+  gdf = pd.concat([load_geojson(url) for url in urls], ignore_index=True)
+  if gdf.empty:
+      raise ValueError("no features were loaded")
+  geojson_structure = analyze_geojson_structure(gdf)
+  geojson_structure['prompt_summary'] = describe_structure(geojson_structure)
+  return gdf, geojson_structure
+
+MAX_PROMPT_PROPERTIES = 50
+
+def compile_property_pattern(properties: List[str]) -> re.Pattern:
+  """Compile a single regex matching any lower-cased property name as a whole word, preferring the longest names."""
+  names = sorted({prop.lower() for prop in properties}, key=len, reverse=True)
+  if not names:
+      return re.compile(r'(?!)')
+  return re.compile(r'(?<!\w)(?:' + '|'.join(re.escape(name) for name in names) + r')(?!\w)')
+
+def prompt_phrases(prompt_lower: str, max_words: int = 3) -> Set[str]:
+  """Return every run of up to max_words consecutive words in the prompt, trimmed of punctuation."""
+  words = prompt_lower.split()
+  return {
+      ' '.join(words[i:i + n]).strip('?.,!;:"\'')
+      for n in range(1, max_words + 1)
+      for i in range(len(words) - n + 1)
+  }
+
+def summarize_structure(geojson_structure: Dict[str, Any], max_properties: int = MAX_PROMPT_PROPERTIES) -> Dict[str, Any]:
+  """Reduce the structure to what the model needs: capped property types, feature count and geometry types."""
+  return {
+      "property_types": dict(list(geojson_structure['property_types'].items())[:max_properties]),
+      "omitted_properties": max(len(geojson_structure['properties']) - max_properties, 0),
+      "feature_count": geojson_structure['feature_count'],
+      "geometry_types": geojson_structure['geometry_types']
+  }
+
+def dumps_for_prompt(obj: Any) -> str:
+  """Serialize prompt data with orjson, accepting NumPy scalars and non-string dict keys."""
+  return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode()
+
+def describe_structure(geojson_structure: Dict[str, Any]) -> str:
+  """Build the dataset part of the Gemini prompt, which only changes when new data is loaded."""
   context = (
       f"You are a geospatial data expert. The user has provided a GeoJSON dataset with the following properties: "
-      f"{', '.join(geojson_structure['properties'])}. "
+      f"{', '.join(geojson_structure['properties'][:MAX_PROMPT_PROPERTIES])}. "
       f"The dataset contains {geojson_structure['feature_count']} features with geometry types: {geojson_structure['geometry_types']}. "
       "Analyze the query and provide insights based on the geospatial data available."
   )
+  return f"{context}\n\nGeoJSON structure: {dumps_for_prompt(summarize_structure(geojson_structure))}"
+
+@st.cache_resource
+def get_response_cache() -> diskcache.Cache:
+  """Open the on-disk cache of Gemini responses, shared across sessions and app restarts."""
+  return diskcache.Cache(".gemini_cache")
+
+def ask_gemini(ai_prompt: str) -> Iterator[str]:
+  """Stream Gemini's answer to a prompt, replaying repeated prompts from the response cache.
 
-  # Prepare some basic statistics
+  The full answer is cached only once the stream has been consumed to the end.
+  """
+  cache = get_response_cache()
+  key = hashlib.blake2b(f"{MODEL_NAME}\n{ai_prompt}".encode(), digest_size=16).hexdigest()
+  text = cache.get(key)
+  if text is not None:
+      yield text
+      return
+  chunks = []
+  for chunk in get_model().generate_content(ai_prompt, stream=True):
+      chunks.append(chunk.text)
+      yield chunk.text
+  cache.set(key, ''.join(chunks), expire=24 * 60 * 60)
+
+def process_query(prompt: str, gdf: gpd.GeoDataFrame, geojson_structure: Dict[str, Any], property_pattern: re.Pattern) -> Iterator[str]:
+  """Process user query using Gemini API and geospatial data."""
+  prompt_lower = prompt.lower()
+  props_by_name = geojson_structure['properties_by_name']
+  mentioned = [props_by_name[name] for name in dict.fromkeys(match.group(0) for match in property_pattern.finditer(prompt_lower))]
+
+  # Prepare some basic statistics, limited to the properties the user mentions when there are any
+  top_values = geojson_structure['top_values']
+  stats_props = mentioned or geojson_structure['properties'][:MAX_PROMPT_PROPERTIES]
   stats = {
       "feature_count": len(gdf),
-      "property_stats": {prop: gdf[prop].value_counts().to_dict() for prop in geojson_structure['properties'] if gdf[prop].dtype in ['object', 'int64', 'float64']}
+      "property_stats": {prop: top_values[prop] for prop in stats_props if prop in top_values}
   }
 
   # If the query is about counting or statistics
-  if any(keyword in prompt.lower() for keyword in ["how many", "count", "average", "mean", "median", "sum"]):
-      for prop in geojson_structure['properties']:
-          if prop.lower() in prompt.lower():
-              if gdf[prop].dtype in ['int64', 'float64']:
-                  stats[f"{prop}_mean"] = gdf[prop].mean()
-                  stats[f"{prop}_median"] = gdf[prop].median()
-                  stats[f"{prop}_sum"] = gdf[prop].sum()
-              value_counts = gdf[prop].value_counts()
-              stats[f"{prop}_top_values"] = value_counts.head().to_dict()
+  if mentioned and any(keyword in prompt_lower for keyword in ["how many", "count", "average", "mean", "median", "sum"]):
+      phrases = prompt_phrases(prompt_lower)
+      for prop in mentioned:
+          if prop in geojson_structure['numeric_stats']:
+              for stat, value in geojson_structure['numeric_stats'][prop].items():
+                  stats[f"{prop}_{stat}"] = value
+          if prop in top_values:
+              stats[f"{prop}_top_values"] = dict(islice(top_values[prop].items(), 5))
+              value_index = geojson_structure['value_index'][prop]
+              for phrase in phrases:
+                  if phrase in value_index:
+                      stats[f"{prop}_{phrase}_count"] = value_index[phrase]
 
   # Pass the query to Gemini along with the context and stats
-  chat = model.start_chat(history=[])
-  response = chat.send_message(
-      f"{context}\n\nUser query: {prompt}\n\n"
-      f"GeoJSON structure: {json.dumps(geojson_structure)}\n\n"
-      f"Statistics: {json.dumps(stats)}"
+  return ask_gemini(
+      f"{geojson_structure['prompt_summary']}\n\nUser query: {prompt}\n\n"
+      f"Statistics: {dumps_for_prompt(stats)}"
   )
-  
-  return response.text
 
 def main():
   st.set_page_config(page_title="GeoJSON Data Explorer", layout="wide")
@@ -101,32 +289,57 @@ def main():
       st.session_state.gdf = None
   if "geojson_structure" not in st.session_state:
       st.session_state.geojson_structure = None
+  if "loaded_urls" not in st.session_state:
+      st.session_state.loaded_urls = None
+  if "prop_regex" not in st.session_state:
+      st.session_state.prop_regex = None
+  if "bounds" not in st.session_state:
+      st.session_state.bounds = None
 
   # Create two columns
   col1, col2 = st.columns([2, 1])
 
   with col1:
       # GeoJSON input section
-      st.subheader("Enter a GeoJSON URL:")
-      url_input = st.text_input("GeoJSON URL")
+      st.subheader("Enter GeoJSON URLs (one per line):")
+      url_input = st.text_area("GeoJSON URLs")
 
       if st.button("Load GeoJSON"):
-          if url_input:
-              with st.spinner("Loading GeoJSON data..."):
+          valid_urls = list(dict.fromkeys(url.strip() for url in url_input.splitlines() if url.strip()))
+          if valid_urls:
+              with st.status("Loading GeoJSON data...", expanded=True) as status:
+                  loaded = set()
+                  with ThreadPoolExecutor(max_workers=5, thread_name_prefix="geojson-loader") as executor:
+                      futures = {executor.submit(load_geojson, url): url for url in valid_urls}
+                      for done, future in enumerate(as_completed(futures), start=1):
+                          url = futures[future]
+                          try:
+                              future.result()
+                              loaded.add(url)
+                              st.success(f"Loaded {url}")
+                          except Exception as e:
+                              st.error(f"Failed to load {url}: {str(e)}")
+                          status.update(label=f"Loading GeoJSON data... ({done}/{len(valid_urls)})")
+                  loaded_urls = tuple(url for url in valid_urls if url in loaded)
+                  label = f"Loaded {len(loaded)} of {len(valid_urls)} GeoJSON URL(s)"
                   try:
-                      async def load_data():
-                          async with aiohttp.ClientSession() as session:
-                              return await fetch_geojson_data(session, url_input)
-                      geojson_data = asyncio.run(load_data())
-                      st.session_state.gdf = gpd.GeoDataFrame.from_features(geojson_data['features'])
-                      st.session_state.geojson_structure = analyze_geojson_structure(st.session_state.gdf)
+                      st.session_state.gdf, st.session_state.geojson_structure = build_dataset(loaded_urls)
+                      st.session_state.prop_regex = compile_property_pattern(st.session_state.geojson_structure['properties'])
+                      st.session_state.bounds = st.session_state.gdf.total_bounds
+                      st.session_state.loaded_urls = loaded_urls
                       st.success("GeoJSON data loaded successfully.")
+                      all_loaded = len(loaded) == len(valid_urls)
+                      status.update(label=label, state="complete" if all_loaded else "error", expanded=not all_loaded)
                   except Exception as e:
                       st.error(f"Failed to load GeoJSON data: {str(e)}")
+                      status.update(label=f"{label}; failed to build the dataset", state="error", expanded=True)
                       st.session_state.gdf = None
                       st.session_state.geojson_structure = None
+                      st.session_state.loaded_urls = None
+                      st.session_state.prop_regex = None
+                      st.session_state.bounds = None
           else:
-              st.error("Please specify a valid GeoJSON URL.")
+              st.error("Please specify at least one valid GeoJSON URL.")
 
       # Display available properties
       if st.session_state.geojson_structure:
@@ -140,15 +353,16 @@ def main():
       # Visualization section
       if st.session_state.gdf is not None:
           st.subheader("Visualize GeoJSON")
-          center_lat = st.number_input("Center Latitude", value=st.session_state.gdf.total_bounds[1])
-          center_lon = st.number_input("Center Longitude", value=st.session_state.gdf.total_bounds[0])
+          center_lat = st.number_input("Center Latitude", value=st.session_state.bounds[1])
+          center_lon = st.number_input("Center Longitude", value=st.session_state.bounds[0])
           zoom_level = st.slider("Zoom Level", min_value=1, max_value=18, value=10)
           
           if st.button("Create Map"):
               with st.spinner("Creating map..."):
                   try:
-                      folium_map = create_map(st.session_state.gdf, center=[center_lat, center_lon], zoom=zoom_level)
-                      folium_static(folium_map, width=700, height=500)
+                      map_data = prepare_map_data(st.session_state.gdf, st.session_state.loaded_urls)
+                      deck = create_map(map_data, center=[center_lat, center_lon], zoom=zoom_level)
+                      st.pydeck_chart(deck)
                   except Exception as e:
                       st.error(f"Failed to create map: {str(e)}")
 
@@ -166,14 +380,12 @@ def main():
           st.session_state.messages.append({"role": "user", "content": prompt})
 
           if st.session_state.gdf is not None:
-              with st.spinner("Processing your query..."):
-                  try:
-                      response = process_query(prompt, st.session_state.gdf, st.session_state.geojson_structure)
-                      with st.chat_message("assistant"):
-                          st.markdown(response)
-                      st.session_state.messages.append({"role": "assistant", "content": response})
-                  except Exception as e:
-                      st.error(f"Failed to process query: {str(e)}")
+              try:
+                  with st.chat_message("assistant"):
+                      response = st.write_stream(process_query(prompt, st.session_state.gdf, st.session_state.geojson_structure, st.session_state.prop_regex))
+                  st.session_state.messages.append({"role": "assistant", "content": response})
+              except Exception as e:
+                  st.error(f"Failed to process query: {str(e)}")
           else:
               st.error("Please load GeoJSON data before asking questions.")
 